@@ -1,17 +1,71 @@
 import pandas as pd
 import numpy as np
 from typing import Dict, List, Any
+from datetime import datetime, timezone
 import uuid
 from google.cloud import firestore
 from fastapi import HTTPException # Import HTTPException
 from .pricing_service import PricingService
 from .predictive_analytics_service import PredictiveAnalyticsService
 
+# --- Materialized Rollups ---
+# customerRollups/{customerId} holds running totals, distributions, cost by provider and
+# history across all of a customer's assessments; its assessments/{docCode} subcollection
+# holds the same rollup for each single assessment.
+ROLLUPS_COLLECTION = 'customerRollups'
+ASSESSMENT_ROLLUPS_SUBCOLLECTION = 'assessments'
+MAX_ROLLUP_HISTORY = 200 # Keeps the customer rollup well under the 1 MiB document limit
+
+@firestore.transactional
+def _commit_assessment(transaction, metric_writes: List[tuple], customer_ref, assessment_ref, rollup: Dict[str, Any]) -> bool:
+    """
+    Writes the per-VM metrics and the assessment rollup, and folds the rollup into
+    the customer rollup, all in one transaction. Returns False without writing
+    anything if the customer already has an assessment with this doc code.
+    """
+    if assessment_ref.get(transaction=transaction).exists:
+        return False
+    customer_snapshot = customer_ref.get(transaction=transaction)
+    history = (customer_snapshot.to_dict() or {}).get('history', []) if customer_snapshot.exists else []
+
+    partial = rollup.get('partial', False)
+    history_point = {
+        'assessmentId': rollup['assessmentId'],
+        'docCode': rollup['docCode'],
+        'sourceType': rollup['sourceType'],
+        'recordedAt': datetime.now(timezone.utc),
+        'totals': rollup['totals'],
+        'costByProvider': rollup['costByProvider'],
+        'partial': partial,
+    }
+
+    for doc_ref, metric in metric_writes:
+        transaction.set(doc_ref, metric)
+    transaction.create(assessment_ref, {**rollup, 'createdAt': firestore.SERVER_TIMESTAMP})
+    transaction.set(customer_ref, {
+        'customerId': rollup['customerId'],
+        'assessmentCount': firestore.Increment(1),
+        'partialAssessmentCount': firestore.Increment(1 if partial else 0),
+        'totals': {k: firestore.Increment(v) for k, v in rollup['totals'].items()},
+        'distributions': {
+            name: {k: firestore.Increment(v) for k, v in dist.items()}
+            for name, dist in rollup['distributions'].items()
+        },
+        'costByProvider': {k: firestore.Increment(v) for k, v in rollup['costByProvider'].items()},
+        'history': (history + [history_point])[-MAX_ROLLUP_HISTORY:],
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    return True
+
 # --- Guru Grade Assessment Engine ---
 class CloudAssessmentEngine:
     def __init__(self):
         self.pricing_service = PricingService()
         self.pricing_data = self.pricing_service.get_all_cloud_pricing()
+        self.storage_tier_index = {
+            provider: self._build_storage_tier_index(tiers)
+            for provider, tiers in self.pricing_service.get_all_storage_pricing().items()
+        }
         self.predictive_analytics_service = PredictiveAnalyticsService()
         try:
             self.db = firestore.Client()
@@ -19,11 +73,14 @@ class CloudAssessmentEngine:
             print(f"Warning: Firestore client could not be initialized: {e}")
             self.db = None
 
-    def _save_metrics_to_firestore(self, df: pd.DataFrame, assessment_id: str, source_type: str, customer_id: str, doc_code: str):
+    def _save_metrics_to_firestore(self, df: pd.DataFrame, analysis: Dict[str, Any], source_type: str, customer_id: str, doc_code: str):
         if not self.db:
             print("Skipping metric save: Firestore client not available.")
             return
 
+        assessment_id = analysis['assessmentId']
+        duplicate_error = HTTPException(status_code=409, detail=f"Doc code '{doc_code}' already exists for customer '{customer_id}'. Please choose another.")
+
         # Check for existing doc_code for this customer
         existing_docs = self.db.collection('assessmentMetrics')\
             .where('customerId', '==', customer_id)\
@@ -31,9 +88,9 @@ class CloudAssessmentEngine:
             .limit(1).get()
         
         if len(list(existing_docs)) > 0:
-            raise HTTPException(status_code=409, detail=f"Doc code '{doc_code}' already exists for customer '{customer_id}'. Please choose another.")
+            raise duplicate_error
 
-        batch = self.db.batch()
+        metric_writes = []
         metrics_collection = self.db.collection('assessmentMetrics')
         timestamp = firestore.SERVER_TIMESTAMP
 
@@ -51,24 +108,145 @@ class CloudAssessmentEngine:
             }
             
             # Add CPU metric
-            cpu_doc_ref = metrics_collection.document()
             cpu_metric = base_metric.copy()
             cpu_metric.update({'metricType': 'cpu_cores', 'value': vm.get('CPUs', 0)})
-            batch.set(cpu_doc_ref, cpu_metric)
+            metric_writes.append((metrics_collection.document(), cpu_metric))
 
             # Add Memory metric
-            mem_doc_ref = metrics_collection.document()
             mem_metric = base_metric.copy()
             mem_metric.update({'metricType': 'memory_gb', 'value': vm.get('Memory', 0) / 1024})
-            batch.set(mem_doc_ref, mem_metric)
+            metric_writes.append((metrics_collection.document(), mem_metric))
 
         try:
-            batch.commit()
-            print(f"Successfully saved {len(batch._writes)} metrics for assessment {assessment_id}.")
+            if customer_id:
+                # Metrics and rollups commit together, keyed by doc code, so neither can land without the other
+                rollup = self._build_assessment_rollup(df, analysis, source_type, customer_id, doc_code)
+                customer_ref = self.db.collection(ROLLUPS_COLLECTION).document(customer_id)
+                assessment_ref = customer_ref.collection(ASSESSMENT_ROLLUPS_SUBCOLLECTION).document(doc_code)
+                committed = _commit_assessment(self.db.transaction(), metric_writes, customer_ref, assessment_ref, rollup)
+            else:
+                batch = self.db.batch()
+                for doc_ref, metric in metric_writes:
+                    batch.set(doc_ref, metric)
+                batch.commit()
+                committed = True
         except Exception as e:
             print(f"Error saving metrics to Firestore: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to save metrics: {str(e)}")
 
+        if not committed:
+            raise duplicate_error
+        print(f"Successfully saved {len(metric_writes)} metrics for assessment {assessment_id}.")
+
+    def _build_assessment_rollup(self, df: pd.DataFrame, analysis: Dict[str, Any], source_type: str, customer_id: str, doc_code: str) -> Dict[str, Any]:
+        """Summarizes one assessment into the totals and distributions kept in the rollups."""
+        summary = analysis['summary']
+        storage = analysis.get('storage_analysis') or {}
+
+        def counts(series: pd.Series) -> Dict[str, int]:
+            values = series.fillna('Unknown').astype(str).replace('', 'Unknown')
+            return {k: int(v) for k, v in values.value_counts().items()}
+
+        return {
+            'assessmentId': analysis['assessmentId'],
+            'customerId': customer_id,
+            'docCode': doc_code,
+            'sourceType': source_type,
+            'totals': {
+                'vms': int(summary['total_vms']),
+                'poweredOnVms': int(summary['powered_on_vms']),
+                'vcpus': int(summary['total_vcpus']),
+                'memoryGb': int(summary['total_memory_gb']),
+                'storageGb': int(storage.get('total_storage_gb', 0)),
+                'disks': int(storage.get('total_disks', 0)),
+            },
+            'distributions': {
+                'cpu': {k: int(v) for k, v in analysis['compute_analysis']['cpu_distribution'].items()},
+                'os': counts(df['OS']),
+                'powerState': counts(df['Powerstate']),
+                'readiness': {k: int(v) for k, v in analysis['cloud_readiness'].items()},
+            },
+            'costByProvider': {
+                provider: float(estimate['monthly_cost'])
+                for provider, estimate in analysis['cost_estimates'].items()
+            },
+        }
+
+    def _build_backfill_rollup(self, customer_id: str, doc_code: str, assessment: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Summarizes an assessment saved before rollups existed from its per-VM metrics.
+        Those only hold CPU cores and memory for every VM regardless of power state,
+        so the rollup is flagged partial and has no power, OS, storage or cost figures.
+        """
+        vms = assessment['vms'].values()
+        cpu_counts = pd.Series([int(vm.get('cpu_cores') or 0) for vm in vms], dtype=int).value_counts()
+        return {
+            'assessmentId': assessment['assessmentId'],
+            'customerId': customer_id,
+            'docCode': doc_code,
+            'sourceType': assessment['sourceType'],
+            'partial': True,
+            'totals': {
+                'vms': len(vms),
+                'vcpus': int(sum(int(vm.get('cpu_cores') or 0) for vm in vms)),
+                'memoryGb': int(sum(float(vm.get('memory_gb') or 0) for vm in vms)),
+            },
+            'distributions': {'cpu': {str(k): int(v) for k, v in cpu_counts.items()}},
+            'costByProvider': {},
+        }
+
+    def backfill_customer_rollup(self, customer_id: str) -> Dict[str, Any]:
+        """
+        Folds assessments stored in assessmentMetrics before rollups were maintained
+        into the customer's rollups. Doc codes that are already rolled up are skipped,
+        so this is safe to run more than once.
+        """
+        if not self.db:
+            raise HTTPException(status_code=503, detail="Firestore client not available.")
+
+        assessments = {}
+        for doc in self.db.collection('assessmentMetrics').where('customerId', '==', customer_id).stream():
+            metric = doc.to_dict()
+            assessment = assessments.setdefault(metric.get('docCode'), {
+                'assessmentId': metric.get('assessmentId'),
+                'sourceType': metric.get('sourceType'),
+                'vms': {}
+            })
+            assessment['vms'].setdefault(metric.get('entityId'), {})[metric.get('metricType')] = metric.get('value')
+
+        customer_ref = self.db.collection(ROLLUPS_COLLECTION).document(customer_id)
+        backfilled = []
+        for doc_code, assessment in assessments.items():
+            if not doc_code:
+                continue
+            rollup = self._build_backfill_rollup(customer_id, doc_code, assessment)
+            assessment_ref = customer_ref.collection(ASSESSMENT_ROLLUPS_SUBCOLLECTION).document(doc_code)
+            if _commit_assessment(self.db.transaction(), [], customer_ref, assessment_ref, rollup):
+                backfilled.append(doc_code)
+
+        return {
+            'customerId': customer_id,
+            'backfilledDocCodes': sorted(backfilled),
+            'alreadyRolledUp': len(assessments) - len(backfilled),
+        }
+
+    def get_customer_rollup(self, customer_id: str) -> Dict[str, Any]:
+        """Returns the materialized rollup across all of a customer's assessments."""
+        return self._read_rollup(f"customer '{customer_id}'", ROLLUPS_COLLECTION, customer_id)
+
+    def get_assessment_rollup(self, customer_id: str, doc_code: str) -> Dict[str, Any]:
+        """Returns the materialized rollup for a single assessment."""
+        return self._read_rollup(f"doc code '{doc_code}' of customer '{customer_id}'", ROLLUPS_COLLECTION, customer_id,
+                                 ASSESSMENT_ROLLUPS_SUBCOLLECTION, doc_code)
+
+    def _read_rollup(self, label: str, *path: str) -> Dict[str, Any]:
+        if not self.db:
+            raise HTTPException(status_code=503, detail="Firestore client not available.")
+        snapshot = self.db.document(*path).get()
+        if not snapshot.exists:
+            raise HTTPException(status_code=404, detail=f"No rollup found for {label}.")
+        return snapshot.to_dict()
+
     def analyze_rvtools_data(self, df_vinfo: pd.DataFrame, df_vcpu: pd.DataFrame = None, 
                            df_vmemory: pd.DataFrame = None, df_vdisk: pd.DataFrame = None, 
                            customer_id: str = "", doc_code: str = "") -> Dict[str, Any]:
@@ -81,15 +259,17 @@ class CloudAssessmentEngine:
             'VM': 'VM'
         })
 
+        storage_analysis = self._analyze_storage_requirements(df_vdisk) if df_vdisk is not None else {}
+
         analysis = {
             'assessmentId': assessment_id,
             'summary': self._get_infrastructure_summary(df_vinfo_processed),
             'compute_analysis': self._analyze_compute_resources(df_vinfo_processed, df_vcpu),
             'memory_analysis': self._analyze_memory_usage(df_vinfo_processed, df_vmemory),
-            'storage_analysis': self._analyze_storage_requirements(df_vdisk) if df_vdisk is not None else {},
+            'storage_analysis': storage_analysis,
             'licensing_analysis': self._analyze_licensing(df_vinfo_processed),
             'cloud_readiness': self._assess_cloud_readiness(df_vinfo_processed),
-            'cost_estimates': self._estimate_cloud_costs(df_vinfo_processed),
+            'cost_estimates': self._estimate_cloud_costs(df_vinfo_processed, storage_analysis),
             'migration_complexity': self._assess_migration_complexity(df_vinfo_processed),
             'recommendations': []
         }
@@ -97,7 +277,7 @@ class CloudAssessmentEngine:
         analysis['predictive_analytics'] = self._run_predictive_analysis(df_vinfo_processed)
         analysis['recommendations'] = self._generate_recommendations(analysis)
 
-        self._save_metrics_to_firestore(df_vinfo_processed, assessment_id, 'rvtools', customer_id, doc_code)
+        self._save_metrics_to_firestore(df_vinfo_processed, analysis, 'rvtools', customer_id, doc_code)
         return analysis
 
     def analyze_azmigrate_data(self, df_az: pd.DataFrame, customer_id: str = "", doc_code: str = "") -> Dict[str, Any]:
@@ -128,7 +308,7 @@ class CloudAssessmentEngine:
         analysis['predictive_analytics'] = self._run_predictive_analysis(df_processed)
         analysis['recommendations'] = self._generate_recommendations(analysis)
 
-        self._save_metrics_to_firestore(df_processed, assessment_id, 'azmigrate', customer_id, doc_code)
+        self._save_metrics_to_firestore(df_processed, analysis, 'azmigrate', customer_id, doc_code)
         return analysis
 
     def _run_predictive_analysis(self, df_vinfo: pd.DataFrame) -> Dict[str, Any]:
@@ -161,15 +341,72 @@ class CloudAssessmentEngine:
             'right_sizing_candidates_memory': len(memory_gb[memory_gb > 32]),
         }
 
+    def _build_storage_tier_index(self, tiers: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Builds array lookups over tiers already sorted by max_size_gb."""
+        return {
+            'types': np.array([t['type'] for t in tiers]),
+            'max_size_gb': np.array([t['max_size_gb'] for t in tiers], dtype=float),
+            'cost_monthly': np.array([t['cost_monthly'] for t in tiers], dtype=float),
+            'cost_per_gb_monthly': np.array([t['cost_per_gb_monthly'] for t in tiers], dtype=float),
+        }
+
+    def _map_disks_to_storage_tiers(self, capacity_gb: np.ndarray, tier_index: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Maps every disk to the smallest tier that fits it with a binary search over
+        the sorted tier sizes. Disks larger than the biggest tier are striped across
+        as many of the biggest tier as needed.
+        """
+        max_sizes = tier_index['max_size_gb']
+        tier_pos = np.searchsorted(max_sizes, capacity_gb, side='left')
+        oversized = tier_pos >= len(max_sizes)
+        tier_pos = np.minimum(tier_pos, len(max_sizes) - 1)
+        units = np.where(oversized, np.ceil(capacity_gb / max_sizes[-1]), 1.0)
+        disk_cost = units * tier_index['cost_monthly'][tier_pos] + capacity_gb * tier_index['cost_per_gb_monthly'][tier_pos]
+
+        tier_counts = np.bincount(tier_pos, minlength=len(max_sizes))
+        return {
+            'monthly_cost': round(float(disk_cost.sum()), 2),
+            'tier_distribution': {str(t): int(c) for t, c in zip(tier_index['types'], tier_counts) if c > 0},
+            'oversized_disks': int(oversized.sum()),
+        }
+
     def _analyze_storage_requirements(self, df_vdisk: pd.DataFrame) -> Dict[str, Any]:
         if df_vdisk is None or df_vdisk.empty:
             return {}
-        total_gb = df_vdisk['Capacity MB'].sum() / 1024
-        return {
+        # Disks with a missing, unparseable or zero capacity can't be mapped to a tier
+        capacity_gb = pd.to_numeric(df_vdisk['Capacity MB'], errors='coerce') / 1024
+        valid = capacity_gb > 0
+        capacity_gb = capacity_gb[valid]
+        if capacity_gb.empty:
+            return {}
+
+        disk_values = capacity_gb.to_numpy(dtype=float)
+        total_gb = disk_values.sum()
+        storage = {
             'total_storage_gb': int(total_gb),
             'total_storage_tb': int(total_gb / 1024),
+            'total_disks': len(disk_values),
+            'largest_disk_gb': int(disk_values.max()),
         }
 
+        # Per-VM stats need the owning VM of each disk
+        if 'VM' in df_vdisk.columns:
+            per_vm = capacity_gb.groupby(df_vdisk.loc[valid, 'VM'], sort=False).agg(['count', 'sum'])
+            largest_vms = per_vm['sum'].nlargest(5)
+            storage.update({
+                'vms_with_disks': len(per_vm),
+                'avg_disks_per_vm': round(float(per_vm['count'].mean()), 2),
+                'avg_storage_per_vm_gb': int(per_vm['sum'].mean()),
+                'largest_vms_by_storage': [{'vm_name': str(vm), 'storage_gb': int(gb)} for vm, gb in largest_vms.items()],
+            })
+
+        storage['storage_tiering'] = {
+            provider: self._map_disks_to_storage_tiers(disk_values, tier_index)
+            for provider, tier_index in self.storage_tier_index.items()
+            if len(tier_index['max_size_gb']) > 0
+        }
+        return storage
+
     def _analyze_licensing(self, df: pd.DataFrame) -> Dict[str, Any]:
         os_counts = df['OS'].value_counts()
         windows_vms = sum(count for os, count in os_counts.items() if 'windows' in str(os).lower())
@@ -186,12 +423,17 @@ class CloudAssessmentEngine:
         complex_migration = len(df[(df['CPUs'] > 8) | (df['Memory'] > 65536)])
         return {'ready': ready, 'needsWork': needs_work, 'complex': complex_migration}
 
-    def _estimate_cloud_costs(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def _estimate_cloud_costs(self, df: pd.DataFrame, storage_analysis: Dict[str, Any] = None) -> Dict[str, Any]:
         powered_on = df[df['Powerstate'] == 'poweredOn']
         if powered_on.empty: return {}
+        storage_tiering = (storage_analysis or {}).get('storage_tiering', {})
 
         cost_estimates = {}
         for provider, data in self.pricing_data.items():
+            if not data.get('instances'):
+                print(f"Skipping {provider} cost estimate: no instance pricing available.")
+                continue
+            largest_instance = max(data['instances'], key=lambda x: x['cost_hourly'])
             total_cost = 0
             instance_mapping = []
             for _, vm in powered_on.iterrows():
@@ -200,15 +442,21 @@ class CloudAssessmentEngine:
                 best_fit = min(
                     (inst for inst in data['instances'] if inst['cpu'] >= cpu and inst['memory'] >= mem),
                     key=lambda x: x['cost_hourly'],
-                    default=max(data['instances'], key=lambda x: x['cost_hourly']) # Default to largest if no fit
+                    default=largest_instance # Default to largest if no fit
                 )
                 total_cost += best_fit['cost_hourly'] * 730 # 730 hours in a month
                 instance_mapping.append({'vm_name': vm.get('VM', 'N/A'), 'mapped_instance': best_fit['type']})
 
+            storage_cost = storage_tiering.get(provider, {}).get('monthly_cost', 0.0)
+            monthly_cost = total_cost + storage_cost
+
             cost_estimates[provider] = {
-                'monthly_cost': round(total_cost, 2),
-                'annual_cost': round(total_cost * 12, 2),
-                'instance_mapping': instance_mapping[:5] # Show a sample of mappings
+                'monthly_cost': round(monthly_cost, 2),
+                'annual_cost': round(monthly_cost * 12, 2),
+                'compute_monthly_cost': round(total_cost, 2),
+                'storage_monthly_cost': round(storage_cost, 2),
+                'instance_mapping': instance_mapping[:5], # Show a sample of mappings
+                'storage_tier_distribution': storage_tiering.get(provider, {}).get('tier_distribution', {})
             }
         return cost_estimates
 
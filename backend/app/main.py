@@ -2,7 +2,7 @@ from fastapi import FastAPI, HTTPException, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
 import os
-from .cloud_assessment import CloudAssessmentEngine
+from .cloud_assessment import CloudAssessmentEngine, ROLLUPS_COLLECTION
 from .cloud_connector_service import CloudConnectorService
 from google.cloud import firestore
 
@@ -105,10 +105,49 @@ async def delete_customer_data(customer_id: str):
         if deleted_count > 0: # Commit any remaining documents
             batch.commit()
 
+        # Drop the materialized rollups so dashboards don't keep serving deleted data
+        db.recursive_delete(db.collection(ROLLUPS_COLLECTION).document(customer_id))
+
         return {"message": f"Successfully deleted {deleted_count} metrics for customer {customer_id}."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete data for customer {customer_id}: {str(e)}")
 
+@app.get("/customer-rollups/{customer_id}", tags=["Dashboards"])
+async def get_customer_rollup(customer_id: str):
+    """
+    Returns the materialized totals, distributions, cost by provider and history
+    across all assessments of a customer, read from a single document.
+    Assessments saved before rollups existed are only included once
+    POST /customer-rollups/{customer_id}/backfill has run for the customer;
+    partialAssessmentCount counts those backfilled without power, OS, storage
+    or cost figures.
+    """
+    if not (isinstance(customer_id, str) and len(customer_id) == 4):
+        raise HTTPException(status_code=400, detail="Invalid customer_id: Must be a 4-letter string.")
+    return assessment_engine.get_customer_rollup(customer_id)
+
+@app.post("/customer-rollups/{customer_id}/backfill", tags=["Dashboards"])
+async def backfill_customer_rollup(customer_id: str):
+    """
+    Rebuilds rollups for a customer's assessments that were stored in
+    assessmentMetrics before rollups were maintained on write.
+    """
+    if not (isinstance(customer_id, str) and len(customer_id) == 4):
+        raise HTTPException(status_code=400, detail="Invalid customer_id: Must be a 4-letter string.")
+    return assessment_engine.backfill_customer_rollup(customer_id)
+
+@app.get("/customer-rollups/{customer_id}/assessments/{doc_code}", tags=["Dashboards"])
+async def get_assessment_rollup(customer_id: str, doc_code: str):
+    """
+    Returns the materialized rollup of a single assessment, identified by its
+    doc_code, read from a single document.
+    """
+    if not (isinstance(customer_id, str) and len(customer_id) == 4):
+        raise HTTPException(status_code=400, detail="Invalid customer_id: Must be a 4-letter string.")
+    if not (isinstance(doc_code, str) and len(doc_code) == 2 and doc_code.isdigit()):
+        raise HTTPException(status_code=400, detail="Invalid doc_code: Must be a 2-digit string.")
+    return assessment_engine.get_assessment_rollup(customer_id, doc_code)
+
 @app.get("/fetch-and-analyze-cloud-data", tags=["Data Ingestion"])
 async def fetch_and_analyze_cloud_data(
     provider: str = Query(None, description="Optional: Specify a cloud provider (aws, azure, gcp) to fetch data from. If not specified, fetches from all.")
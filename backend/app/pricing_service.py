@@ -1,8 +1,37 @@
-from typing import Dict, Any
+from typing import Dict, List, Any
 import requests
 import re
 from google.cloud import firestore
 
+# Block storage tiers per provider (list prices, USD per month).
+# A disk maps to the smallest tier whose max_size_gb fits it; the monthly cost is
+# cost_monthly for sized tiers (Azure managed disks) plus cost_per_gb_monthly for
+# provisioned-capacity volumes (EBS, Persistent Disk).
+STORAGE_TIERS = {
+    'aws': [
+        {'type': 'gp3', 'max_size_gb': 16384, 'cost_monthly': 0.0, 'cost_per_gb_monthly': 0.08},
+    ],
+    'azure': [
+        {'type': 'P1', 'max_size_gb': 4, 'cost_monthly': 0.60, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P2', 'max_size_gb': 8, 'cost_monthly': 1.20, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P3', 'max_size_gb': 16, 'cost_monthly': 2.40, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P4', 'max_size_gb': 32, 'cost_monthly': 5.28, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P6', 'max_size_gb': 64, 'cost_monthly': 10.21, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P10', 'max_size_gb': 128, 'cost_monthly': 19.71, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P15', 'max_size_gb': 256, 'cost_monthly': 38.01, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P20', 'max_size_gb': 512, 'cost_monthly': 73.22, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P30', 'max_size_gb': 1024, 'cost_monthly': 135.17, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P40', 'max_size_gb': 2048, 'cost_monthly': 259.05, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P50', 'max_size_gb': 4096, 'cost_monthly': 495.57, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P60', 'max_size_gb': 8192, 'cost_monthly': 946.08, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P70', 'max_size_gb': 16384, 'cost_monthly': 1802.06, 'cost_per_gb_monthly': 0.0},
+        {'type': 'P80', 'max_size_gb': 32767, 'cost_monthly': 3604.12, 'cost_per_gb_monthly': 0.0},
+    ],
+    'gcp': [
+        {'type': 'pd-balanced', 'max_size_gb': 65536, 'cost_monthly': 0.0, 'cost_per_gb_monthly': 0.10},
+    ],
+}
+
 class PricingService:
     def __init__(self):
         # Initialize Firestore client
@@ -14,10 +43,6 @@ class PricingService:
             print(f"Warning: Failed to initialize Firestore client: {e}")
             self.db = None
 
-    def _parse_azure_sku(self, sku_name: str) -> Dict[str, Any]:
-        # ... (existing helper function)
-        return {'cpu': 'N/A', 'memory': 'N/A'} # Simplified for brevity
-
     def get_aws_pricing(self) -> Dict[str, Any]:
         """
         Fetches AWS EC2 instance pricing data from the Firestore cache.
@@ -50,10 +75,36 @@ class PricingService:
 
     def get_azure_pricing(self) -> Dict[str, Any]:
         """
-        Fetches Azure VM instance pricing data from the Azure Retail Prices API.
+        Fetches Azure VM instance pricing data from the Firestore cache, populated
+        from the Azure Retail Prices API by the Azure price importer.
         """
-        # ... (existing implementation)
-        return {'region': 'East US', 'instances': []} # Simplified for brevity
+        if not self.db:
+            return {'region': 'East US', 'instances': [], 'error': 'Firestore client not initialized.'}
+
+        try:
+            instances = []
+            # Read every SKU in the region so large VMs still find a fitting size
+            docs = self.db.collection('cloudPricing').where('provider', '==', 'azure').where('region', '==', 'eastus').stream()
+
+            for doc in docs:
+                instance_data = doc.to_dict()
+                if not isinstance(instance_data.get('cpu'), (int, float)) or not isinstance(instance_data.get('memory'), (int, float)):
+                    continue
+                instances.append({
+                    'type': instance_data.get('instanceType'),
+                    'family': instance_data.get('family'),
+                    'cpu': instance_data.get('cpu'),
+                    'memory': instance_data.get('memory'),
+                    'cost_hourly': instance_data.get('costHourly')
+                })
+
+            return {
+                'region': 'East US',
+                'instances': sorted(instances, key=lambda x: x.get('cost_hourly', 0))
+            }
+        except Exception as e:
+            print(f"Error fetching Azure pricing from Firestore: {e}")
+            return {'region': 'East US', 'instances': [], 'error': str(e)}
 
     def get_gcp_pricing(self) -> Dict[str, Any]:
         """
@@ -67,6 +118,18 @@ class PricingService:
             ]
         }
 
+    def get_storage_pricing(self, provider: str) -> List[Dict[str, Any]]:
+        """
+        Returns the block storage tiers for a provider, sorted by max_size_gb.
+        """
+        return sorted(STORAGE_TIERS.get(provider, []), key=lambda x: x['max_size_gb'])
+
+    def get_all_storage_pricing(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Aggregates block storage tiers from all supported cloud providers.
+        """
+        return {provider: self.get_storage_pricing(provider) for provider in STORAGE_TIERS}
+
     def get_all_cloud_pricing(self) -> Dict[str, Any]:
         """
         Aggregates pricing data from all supported cloud providers.
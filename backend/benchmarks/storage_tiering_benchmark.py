@@ -0,0 +1,44 @@
+"""
+Benchmarks the vDisk storage analysis stage on a synthetic RVTools vDisk sheet.
+
+Run from the backend directory:
+    python -m benchmarks.storage_tiering_benchmark [rows]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from app.cloud_assessment import CloudAssessmentEngine
+
+DEFAULT_ROWS = 500_000
+
+def build_vdisk_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Builds a vDisk frame with 1-8 disks per VM and log-normal disk sizes."""
+    rng = np.random.default_rng(seed)
+    disks_per_vm = rng.integers(1, 9, size=rows // 2)
+    vm_ids = np.repeat(np.arange(len(disks_per_vm)), disks_per_vm)[:rows]
+    capacity_mb = np.clip(rng.lognormal(mean=11.5, sigma=1.2, size=len(vm_ids)), 1024, 40 * 1024 * 1024)
+    return pd.DataFrame({
+        'VM': [f"vm-{i:07d}" for i in vm_ids],
+        'Disk': [f"Hard disk {n}" for n in rng.integers(1, 9, size=len(vm_ids))],
+        'Capacity MB': capacity_mb.round(),
+    })
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    df_vdisk = build_vdisk_frame(rows)
+    engine = CloudAssessmentEngine()
+
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        result = engine._analyze_storage_requirements(df_vdisk)
+        timings.append(time.perf_counter() - start)
+
+    print(f"rows={len(df_vdisk)} vms={result['vms_with_disks']} total_tb={result['total_storage_tb']}")
+    for provider, tiering in result['storage_tiering'].items():
+        print(f"  {provider}: ${tiering['monthly_cost']:,.2f}/month across {len(tiering['tier_distribution'])} tiers")
+    print(f"best={min(timings) * 1000:.1f}ms median={sorted(timings)[len(timings) // 2] * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
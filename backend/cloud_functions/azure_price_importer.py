@@ -0,0 +1,288 @@
+import functions_framework
+from google.cloud import firestore
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+import time
+import re
+import os
+
+# --- Environment Setup ---
+# Firestore client, created on first use so the fetch and parse helpers run without credentials.
+# In a GCP environment, credentials are handled automatically.
+_db = None
+
+def _get_db():
+    global _db
+    if _db is None:
+        _db = firestore.Client()
+    return _db
+
+# --- Constants ---
+# Azure Retail Prices API. Overridable so the importer can run against a local paging stub.
+AZURE_PRICES_API_URL = os.getenv('AZURE_PRICES_API_URL', "https://prices.azure.com/api/retail/prices")
+TARGET_REGION = "eastus"
+# Collection name in Firestore
+PRICING_COLLECTION = "cloudPricing"
+# Pages fetched in parallel, and the overall request rate shared by all workers
+FETCH_CONCURRENCY = int(os.getenv('AZURE_PRICES_CONCURRENCY', '8'))
+MAX_REQUESTS_PER_SECOND = float(os.getenv('AZURE_PRICES_MAX_RPS', '10'))
+MAX_RETRIES = 5
+REQUEST_TIMEOUT_SECONDS = 60
+# Attempts per Firestore write before the BulkWriter gives up on it (the library default)
+MAX_WRITE_ATTEMPTS = 15
+
+def _sizes(gib_per_vcpu, sizes):
+    """Builds {size: (vcpus, memory_gib)} for series where the size is the vCPU count."""
+    return {size: (size, size * gib_per_vcpu) for size in sizes}
+
+# Explicit (vCPUs, memory GiB) per size for each supported series, keyed by family letters,
+# feature suffix and version as they appear in the ARM SKU name (Standard_D4as_v5 -> 'Das_v5').
+# SKUs of any other series are skipped rather than guessed.
+_V3_SIZES = [2, 4, 8, 16, 32, 48, 64]
+_V5_SIZES = [2, 4, 8, 16, 32, 48, 64, 96]
+_D_V2 = {1: (1, 3.5), 2: (2, 7), 3: (4, 14), 4: (8, 28), 5: (16, 56),
+         11: (2, 14), 12: (4, 28), 13: (8, 56), 14: (16, 112), 15: (20, 140)}
+_E_V3 = {**_sizes(8, [2, 4, 8, 16, 20, 32, 48]), 64: (64, 432)}
+_E_V4 = {**_sizes(8, [2, 4, 8, 16, 20, 32, 48]), 64: (64, 504)}
+_EA_V4 = {**_sizes(8, [2, 4, 8, 16, 20, 32, 48, 64]), 96: (96, 672)}
+_E_V5 = {**_sizes(8, [2, 4, 8, 16, 20, 32, 48, 64]), 96: (96, 672)}
+
+AZURE_SKU_SPECS = {
+    # A v2 and memory-optimized A m v2
+    'A_v2': _sizes(2, [1, 2, 4, 8]),
+    'Am_v2': {2: (2, 16), 4: (4, 32), 8: (8, 64)},
+    # B burstable
+    'Bls': {1: (1, 0.5)},
+    'Bs': {1: (1, 1), 2: (2, 4)},
+    'Bms': {1: (1, 2), 2: (2, 8), 4: (4, 16), 8: (8, 32), 12: (12, 48), 16: (16, 64), 20: (20, 80)},
+    'Bts_v2': {2: (2, 1)},
+    'Bls_v2': _sizes(2, [2, 4, 8, 16, 32]),
+    'Bs_v2': _sizes(4, [2, 4, 8, 16, 32]),
+    # D general purpose
+    'D_v2': _D_V2,
+    'DS_v2': _D_V2,
+    **{key: _sizes(4, _V3_SIZES) for key in ('D_v3', 'Ds_v3', 'D_v4', 'Ds_v4', 'Dd_v4', 'Dds_v4')},
+    **{key: _sizes(4, _V5_SIZES) for key in ('Da_v4', 'Das_v4', 'D_v5', 'Ds_v5', 'Dd_v5', 'Dds_v5', 'Das_v5', 'Dads_v5')},
+    # E memory optimized
+    'E_v3': _E_V3,
+    'Es_v3': _E_V3,
+    **{key: _E_V4 for key in ('E_v4', 'Es_v4', 'Ed_v4', 'Eds_v4')},
+    **{key: _EA_V4 for key in ('Ea_v4', 'Eas_v4')},
+    **{key: _E_V5 for key in ('E_v5', 'Es_v5', 'Ed_v5', 'Eds_v5', 'Eas_v5', 'Eads_v5')},
+    # F compute optimized
+    'F': _sizes(2, [1, 2, 4, 8, 16]),
+    'Fs': _sizes(2, [1, 2, 4, 8, 16]),
+    'Fs_v2': _sizes(2, [2, 4, 8, 16, 32, 48, 64, 72]),
+    # M memory optimized
+    'M': {64: (64, 1024), 128: (128, 2048)},
+    'Mm': {64: (64, 1792), 128: (128, 3892)},
+    'Ms': {64: (64, 1024), 128: (128, 2048)},
+    'Mls': {32: (32, 256), 64: (64, 512)},
+    'Mts': {32: (32, 192)},
+    'Mms': {8: (8, 218.75), 16: (16, 437.5), 32: (32, 875), 64: (64, 1792), 128: (128, 3892)},
+    # NC GPU
+    'NCs_v3': {6: (6, 112), 12: (12, 224), 24: (24, 448)},
+}
+SKU_PATTERN = re.compile(r'^Standard_([A-Z]+)(\d+)(?:-(\d+))?([a-z]*)(?:_(v\d+))?$')
+
+class _RateLimiter:
+    """Spaces request starts evenly so concurrent workers stay under a shared rate."""
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+class _WriteTally:
+    """
+    BulkWriter callbacks that count committed writes and record writes that failed
+    for good; without them the BulkWriter drops a write silently after its last retry.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.committed = 0
+        self.failures = []
+
+    def on_result(self, doc_ref, write_result, bulk_writer):
+        with self.lock:
+            self.committed += 1
+
+    def on_error(self, failure, bulk_writer):
+        if failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        with self.lock:
+            self.failures.append(f"{failure.operation.reference.id}: {failure.message}")
+        return False
+
+def _parse_azure_sku(sku_name):
+    """
+    Looks up CPU (vCPU) and Memory for an Azure ARM SKU name (e.g. Standard_E8-4as_v5)
+    in AZURE_SKU_SPECS. Constrained-core SKUs keep the memory of their full size.
+    Returns 'N/A' for both when the series or size is not in the table.
+    """
+    match = SKU_PATTERN.match(sku_name or '')
+    if not match:
+        return {'cpu': 'N/A', 'memory': 'N/A'}
+
+    family, size, constrained, features, version = match.groups()
+    series = f"{family}{features}_{version}" if version else f"{family}{features}"
+    specs = AZURE_SKU_SPECS.get(series, {}).get(int(size))
+    if specs is None:
+        return {'cpu': 'N/A', 'memory': 'N/A'}
+
+    vcpu, memory = specs
+    return {'cpu': int(constrained) if constrained else vcpu, 'memory': float(memory)}
+
+def _fetch_page(session, limiter, url):
+    """
+    Fetches one page, backing off on throttling (429), transient server errors and
+    dropped or timed-out connections.
+    """
+    for attempt in range(MAX_RETRIES):
+        limiter.wait()
+        last_attempt = attempt == MAX_RETRIES - 1
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT_SECONDS)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if last_attempt:
+                raise
+            time.sleep(2 ** attempt)
+            continue
+        if (response.status_code == 429 or response.status_code >= 500) and not last_attempt:
+            retry_after = response.headers.get('Retry-After')
+            time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+            continue
+        response.raise_for_status()
+        return response.json()
+
+def _fetch_all_items(session, limiter, first_url):
+    """
+    Walks the NextPageLink chain. The links page with $skip, so once the page size is
+    known the following pages are fetched FETCH_CONCURRENCY at a time until one comes
+    back without a NextPageLink. Unrecognized links are followed one by one.
+    """
+    page = _fetch_page(session, limiter, first_url)
+    items = list(page.get('Items', []))
+    next_link = page.get('NextPageLink')
+    skip_match = re.search(r'\$skip=(\d+)', next_link or '')
+
+    if next_link and not skip_match:
+        while next_link:
+            page = _fetch_page(session, limiter, next_link)
+            items.extend(page.get('Items', []))
+            next_link = page.get('NextPageLink')
+        return items
+
+    page_size = int(skip_match.group(1)) if skip_match else 0
+    skip = page_size
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        while next_link:
+            urls = [re.sub(r'\$skip=\d+', f'$skip={skip + i * page_size}', next_link) for i in range(FETCH_CONCURRENCY)]
+            skip += FETCH_CONCURRENCY * page_size
+            for page in executor.map(lambda url: _fetch_page(session, limiter, url), urls):
+                items.extend(page.get('Items', []))
+                if not page.get('NextPageLink') or not page.get('Items'):
+                    next_link = None
+                    break
+    return items
+
+def _is_linux_on_demand(item):
+    """Keeps Linux pay-as-you-go hourly VM meters, excluding Spot and Low Priority."""
+    if item.get('type') != 'Consumption' or item.get('unitOfMeasure') != '1 Hour':
+        return False
+    if 'Windows' in item.get('productName', ''):
+        return False
+    sku_name = item.get('skuName', '')
+    return 'Spot' not in sku_name and 'Low Priority' not in sku_name
+
+@functions_framework.http
+def update_azure_prices(request):
+    """
+    A Google Cloud Function to be triggered by a scheduler (e.g., weekly).
+    It fetches Azure VM pricing for a specific region and updates Firestore.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_CONCURRENCY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    limiter = _RateLimiter(MAX_REQUESTS_PER_SECOND)
+
+    price_filter = f"serviceName eq 'Virtual Machines' and armRegionName eq '{TARGET_REGION}' and priceType eq 'Consumption'"
+
+    try:
+        # 1. Download every page of the regional price list
+        first_url = requests.Request('GET', AZURE_PRICES_API_URL, params={'$filter': price_filter}).prepare().url
+        print(f"Downloading Azure pricing for {TARGET_REGION} from {AZURE_PRICES_API_URL}...")
+        items = _fetch_all_items(session, limiter, first_url)
+        print(f"Download complete. Parsing {len(items)} price items...")
+
+        # 2. Keep the cheapest Linux on-demand price per SKU
+        cheapest = {}
+        for item in items:
+            if not _is_linux_on_demand(item):
+                continue
+            sku = item.get('armSkuName')
+            try:
+                cost_hourly = float(item.get('retailPrice'))
+            except (ValueError, TypeError):
+                continue
+            if sku and (sku not in cheapest or cost_hourly < cheapest[sku]['retailPrice']):
+                cheapest[sku] = {**item, 'retailPrice': cost_hourly}
+
+        # 3. Write to Firestore in bulk
+        db = _get_db()
+        bulk_writer = db.bulk_writer()
+        tally = _WriteTally()
+        bulk_writer.on_write_result(tally.on_result)
+        bulk_writer.on_write_error(tally.on_error)
+        queued = 0
+        for sku, item in cheapest.items():
+            specs = _parse_azure_sku(sku)
+            if specs['cpu'] == 'N/A':
+                continue
+
+            # Create a structured document
+            price_doc = {
+                'provider': 'azure',
+                'region': item.get('armRegionName', TARGET_REGION),
+                'instanceType': sku,
+                'family': item.get('productName'),
+                'cpu': specs['cpu'],
+                'memory': specs['memory'],
+                'costHourly': item['retailPrice'],
+                'lastUpdated': firestore.SERVER_TIMESTAMP
+            }
+
+            # Use a predictable document ID: azure-<region>-<instanceType>
+            doc_id = f"azure-{price_doc['region']}-{sku}"
+            bulk_writer.set(db.collection(PRICING_COLLECTION).document(doc_id), price_doc, merge=True)
+            queued += 1
+
+        bulk_writer.close()
+
+        if tally.failures:
+            error_message = (f"Failed to write {len(tally.failures)} of {queued} Azure price points "
+                             f"({tally.committed} committed): {'; '.join(tally.failures[:5])}")
+            print(error_message)
+            return (error_message, 500)
+
+        success_message = f"Successfully updated/verified {tally.committed} Azure price points in Firestore."
+        print(success_message)
+        return (success_message, 200)
+
+    except requests.exceptions.RequestException as e:
+        error_message = f"Error fetching Azure pricing data: {e}"
+        print(error_message)
+        return (error_message, 500)
+    except Exception as e:
+        error_message = f"An unexpected error occurred: {e}"
+        print(error_message)
+        return (error_message, 500)
@@ -1,48 +1,302 @@
 import functions_framework
 from google.cloud import firestore
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta, timezone
 import requests
+import hashlib
+import uuid
+import time
 import os
 
+# --- Constants ---
+# Uploads are expected as uploads/<jobId>/<fileName> so the job document is read by key.
+# Flat uploads/<fileName> objects fall back to matching jobs.filePath.
+UPLOAD_PREFIX = "uploads/"
+JOBS_COLLECTION = "jobs"
+# One document per storage event, created in the same transaction that enqueues the upload.
+TRIGGER_EVENTS_COLLECTION = "triggerEvents"
+# Removed by the Firestore TTL policy on expireAt once redeliveries are no longer possible.
+TRIGGER_EVENT_RETENTION = timedelta(days=8)
+# One document per customer holding the batch of uploads currently being coalesced. Jobs are
+# grouped by their customerId field, which whoever creates the jobs/<jobId> document must
+# write (the 4-letter customer code used by /analyze). Jobs without it are sent on their own.
+PROCESSING_BATCHES_COLLECTION = "processingBatches"
+# Closed batches move to processingBatches/<customerId>/dispatches/<batchId> while they are
+# sent, leased so that a batch whose sender died is picked up again by the sweeper.
+DISPATCHES_SUBCOLLECTION = "dispatches"
+DISPATCH_RETENTION = timedelta(days=30)
+# Uploads from the same customer arriving within this window are sent as one request.
+COALESCE_WINDOW_SECONDS = float(os.getenv('COALESCE_WINDOW_SECONDS', '10'))
+# An open batch not dispatched by this long after its window is taken over or swept.
+BATCH_EXPIRY_MARGIN_SECONDS = float(os.getenv('BATCH_EXPIRY_MARGIN_SECONDS', '60'))
+# How long an upload is retried while its job document has not been written yet.
+JOB_WAIT_SECONDS = float(os.getenv('JOB_WAIT_SECONDS', '600'))
+API_TIMEOUT_SECONDS = float(os.getenv('API_TIMEOUT_SECONDS', '30'))
+# A dispatching batch not marked done within this long is sent again by the sweeper.
+DISPATCH_LEASE_SECONDS = float(os.getenv('DISPATCH_LEASE_SECONDS', '120'))
+# Event keys handled by this instance, to skip redelivered events without a Firestore round trip.
+MAX_SEEN_EVENTS = 1024
+
+# --- Clients reused across invocations of a warm instance ---
+_db = None
+_session = None
+_seen_events = {}
+
+def _get_db():
+    global _db
+    if _db is None:
+        _db = firestore.Client()
+    return _db
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+def _remember_event(event_key):
+    if len(_seen_events) >= MAX_SEEN_EVENTS:
+        _seen_events.pop(next(iter(_seen_events)))
+    _seen_events[event_key] = True
+
+def _find_job(db, file_name):
+    """
+    Reads the job for an upload by key from uploads/<jobId>/<fileName>, falling back to
+    the filePath match for flat uploads/<fileName> objects. Returns None if not found.
+    """
+    parts = file_name[len(UPLOAD_PREFIX):].split('/', 1)
+    if len(parts) == 2 and parts[0] and parts[1]:
+        job = db.collection(JOBS_COLLECTION).document(parts[0]).get()
+        if job.exists:
+            return job
+
+    jobs = db.collection(JOBS_COLLECTION).where('filePath', '==', file_name).limit(1).get()
+    return jobs[0] if jobs else None
+
+def _event_age_seconds(cloud_event):
+    try:
+        event_time = datetime.fromisoformat(cloud_event['time'].replace('Z', '+00:00'))
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+    return (datetime.now(timezone.utc) - event_time).total_seconds()
+
+@firestore.transactional
+def _enqueue_upload(transaction, batch_ref, event_ref, event_key, upload, customer_id):
+    """
+    Claims the event and adds the upload to the customer's open batch in one
+    transaction, so an event is recorded only once its upload is enqueued.
+
+    Returns 'duplicate' if the event was already handled, 'coalesced' if the upload
+    joined a batch another invocation will dispatch, or the batch ID if this call
+    opened a new batch and is therefore responsible for dispatching it. An open
+    batch past its expiry is taken over, keeping the uploads already in it.
+    """
+    if event_ref.get(transaction=transaction).exists:
+        return 'duplicate'
+    snapshot = batch_ref.get(transaction=transaction)
+    batch = snapshot.to_dict() if snapshot.exists else None
+    now = datetime.now(timezone.utc)
+
+    transaction.create(event_ref, {
+        'eventKey': event_key,
+        'createdAt': firestore.SERVER_TIMESTAMP,
+        'expireAt': now + TRIGGER_EVENT_RETENTION
+    })
+
+    pending = []
+    if batch and batch.get('status') == 'open':
+        if batch.get('expiresAt') and batch['expiresAt'] > now:
+            transaction.update(batch_ref, {'uploads': firestore.ArrayUnion([upload])})
+            return 'coalesced'
+        pending = [u for u in batch.get('uploads', []) if u != upload]
+
+    batch_id = str(uuid.uuid4())
+    transaction.set(batch_ref, {
+        'batchId': batch_id,
+        'customerId': customer_id,
+        'status': 'open',
+        'openedAt': now,
+        'expiresAt': now + timedelta(seconds=COALESCE_WINDOW_SECONDS + BATCH_EXPIRY_MARGIN_SECONDS),
+        'uploads': pending + [upload]
+    })
+    return batch_id
+
+@firestore.transactional
+def _close_batch(transaction, batch_ref, batch_id):
+    """
+    Moves the open batch into a leased dispatch document and frees the customer's
+    batch slot for new uploads. Returns the dispatch reference, customer ID and
+    uploads, or None if the batch was already closed or taken over by another invocation.
+    """
+    snapshot = batch_ref.get(transaction=transaction)
+    batch = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if batch.get('batchId') != batch_id or batch.get('status') != 'open':
+        return None
+    now = datetime.now(timezone.utc)
+
+    dispatch_ref = batch_ref.collection(DISPATCHES_SUBCOLLECTION).document(batch_id)
+    transaction.set(dispatch_ref, {
+        'batchId': batch_id,
+        'customerId': batch.get('customerId'),
+        'status': 'dispatching',
+        'leaseExpiresAt': now + timedelta(seconds=DISPATCH_LEASE_SECONDS),
+        'expireAt': now + DISPATCH_RETENTION,
+        'uploads': batch.get('uploads', [])
+    })
+    transaction.update(batch_ref, {'status': 'closed', 'closedAt': firestore.SERVER_TIMESTAMP})
+    return dispatch_ref, batch.get('customerId'), batch.get('uploads', [])
+
+@firestore.transactional
+def _renew_dispatch_lease(transaction, dispatch_ref):
+    """Takes over a dispatch whose lease expired. Returns its uploads, or None."""
+    snapshot = dispatch_ref.get(transaction=transaction)
+    dispatch = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    now = datetime.now(timezone.utc)
+    if dispatch.get('status') != 'dispatching' or dispatch.get('leaseExpiresAt', now) > now:
+        return None
+    transaction.update(dispatch_ref, {'leaseExpiresAt': now + timedelta(seconds=DISPATCH_LEASE_SECONDS)})
+    return dispatch.get('uploads', [])
+
+def _mark_jobs_failed(db, uploads, error):
+    batch = db.batch()
+    for upload in uploads:
+        batch.update(db.collection(JOBS_COLLECTION).document(upload['job_id']), {
+            'status': 'error',
+            'error': error
+        })
+    batch.commit()
+
+def _dispatch_batch(customer_id, uploads):
+    """
+    Sends the coalesced uploads to the API as one request. The receiving
+    /process-batch endpoint takes {customer_id, jobs: [{job_id, file_path}]}.
+    """
+    api_url = os.getenv('FASTAPI_URL', 'https://your-cloud-run-url')
+    response = _get_session().post(
+        f"{api_url}/process-batch",
+        json={
+            "customer_id": customer_id,
+            "jobs": uploads
+        },
+        timeout=API_TIMEOUT_SECONDS
+    )
+    response.raise_for_status()
+
+def _send_dispatch(db, dispatch_ref, customer_id, uploads):
+    """
+    Sends a leased dispatch and only then marks it done, so a sender that dies
+    mid-way leaves the lease to expire and the sweeper sends the batch again.
+    """
+    # Trigger FastAPI processing
+    try:
+        _dispatch_batch(customer_id, uploads)
+        print(f"Processing triggered for {len(uploads)} jobs of customer {customer_id}")
+        status = 'dispatched'
+    except Exception as e:
+        print(f"Failed to trigger processing: {e}")
+        # Update job status to error for every job in the batch
+        _mark_jobs_failed(db, uploads, str(e))
+        status = 'failed'
+    dispatch_ref.update({'status': status, 'finishedAt': firestore.SERVER_TIMESTAMP})
+    return len(uploads)
+
+def _close_and_dispatch(db, batch_ref, batch_id):
+    closed = _close_batch(db.transaction(), batch_ref, batch_id)
+    if closed is None:
+        return 0
+    return _send_dispatch(db, *closed)
+
 @functions_framework.cloud_event
 def trigger_processing(cloud_event):
-    """Triggered by Cloud Storage file upload"""
-    
+    """
+    Triggered by Cloud Storage file upload.
+
+    Duplicate deliveries of the same event are ignored, and uploads from the same
+    customer arriving within COALESCE_WINDOW_SECONDS are sent to the API as one
+    /process-batch request by whichever invocation opened the batch. Batches whose
+    opener died are taken over by the next upload or by sweep_processing_batches,
+    which also resends batches whose sender died mid-dispatch.
+    Deploy with retries enabled: an upload whose job is not written yet raises so
+    the event is redelivered, for up to JOB_WAIT_SECONDS.
+
+    To run locally, start `functions-framework --target trigger_processing
+    --signature-type cloudevent` with FIRESTORE_EMULATOR_HOST and FASTAPI_URL
+    pointing at the emulator and a stub API, then POST fixtures/storage_event.json
+    with a `Content-Type: application/cloudevents+json` header.
+    """
+
     data = cloud_event.data
     bucket_name = data['bucket']
     file_name = data['name']
-    
-    if not file_name.startswith('uploads/'):
+
+    if not file_name.startswith(UPLOAD_PREFIX):
         return
-    
-    # Find corresponding job in Firestore
-    db = firestore.Client()
-    jobs = db.collection('jobs').where('filePath', '==', file_name).get()
-    
-    if not jobs:
+
+    event_key = f"{bucket_name}/{file_name}#{data.get('generation', cloud_event['id'])}"
+    if event_key in _seen_events:
+        print(f"Duplicate event ignored: {event_key}")
+        return
+
+    db = _get_db()
+    job = _find_job(db, file_name)
+    if job is None:
+        if _event_age_seconds(cloud_event) < JOB_WAIT_SECONDS:
+            raise LookupError(f"No job found yet for file: {file_name}")
         print(f"No job found for file: {file_name}")
         return
-    
-    job = jobs[0]
-    job_id = job.id
-    
-    # Trigger FastAPI processing
-    api_url = os.getenv('FASTAPI_URL', 'https://your-cloud-run-url')
-    
-    try:
-        response = requests.post(
-            f"{api_url}/process-file",
-            json={
-                "job_id": job_id,
-                "file_path": file_name
-            }
-        )
-        response.raise_for_status()
-        print(f"Processing triggered for job: {job_id}")
-        
-    except Exception as e:
-        print(f"Failed to trigger processing: {e}")
-        # Update job status to error
-        db.collection('jobs').document(job_id).update({
-            'status': 'error',
-            'error': str(e)
-        })
\ No newline at end of file
+
+    customer_id = (job.to_dict() or {}).get('customerId')
+    upload = {'job_id': job.id, 'file_path': file_name}
+    if customer_id:
+        batch_ref = db.collection(PROCESSING_BATCHES_COLLECTION).document(customer_id)
+    else:
+        print(f"Job {job.id} has no customerId; sending {file_name} without coalescing")
+        batch_ref = db.collection(PROCESSING_BATCHES_COLLECTION).document(f"job-{job.id}")
+    event_ref = db.collection(TRIGGER_EVENTS_COLLECTION).document(hashlib.sha256(event_key.encode()).hexdigest())
+
+    outcome = _enqueue_upload(db.transaction(), batch_ref, event_ref, event_key, upload, customer_id)
+    _remember_event(event_key)
+    if outcome == 'duplicate':
+        print(f"Duplicate event ignored: {event_key}")
+        return
+    if outcome == 'coalesced':
+        print(f"Job {job.id} coalesced into open batch for customer {customer_id}")
+        return
+
+    # This invocation opened the batch: wait for the rest of the customer's uploads.
+    if customer_id:
+        time.sleep(COALESCE_WINDOW_SECONDS)
+    _close_and_dispatch(db, batch_ref, outcome)
+
+@functions_framework.http
+def sweep_processing_batches(request):
+    """
+    A Google Cloud Function to be triggered by a scheduler (e.g., every minute).
+    It dispatches open batches past their expiry whose opening invocation died
+    before closing them, and sends again any dispatch whose lease expired before
+    its sender marked it done.
+    """
+    db = _get_db()
+    now = datetime.now(timezone.utc)
+    dispatched = 0
+
+    expired_batches = db.collection(PROCESSING_BATCHES_COLLECTION)\
+        .where('status', '==', 'open')\
+        .where('expiresAt', '<', now).stream()
+    for snapshot in expired_batches:
+        dispatched += _close_and_dispatch(db, snapshot.reference, snapshot.to_dict().get('batchId'))
+
+    expired_leases = db.collection_group(DISPATCHES_SUBCOLLECTION)\
+        .where('status', '==', 'dispatching')\
+        .where('leaseExpiresAt', '<', now).stream()
+    for snapshot in expired_leases:
+        uploads = _renew_dispatch_lease(db.transaction(), snapshot.reference)
+        if uploads:
+            dispatched += _send_dispatch(db, snapshot.reference, snapshot.to_dict().get('customerId'), uploads)
+
+    message = f"Swept expired batches: dispatched {dispatched} uploads."
+    print(message)
+    return (message, 200)
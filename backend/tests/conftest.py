@@ -0,0 +1,58 @@
+# Run from backend/: pip install -r requirements-dev.txt && python -m pytest tests
+# Set FIRESTORE_EMULATOR_HOST to also run the tests that use Firestore.
+import json
+import os
+import sys
+import pytest
+from cloudevents.http import CloudEvent
+from stubs import StubProcessingAPI
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOUD_FUNCTIONS_DIR = os.path.join(BACKEND_DIR, 'cloud_functions')
+sys.path.insert(0, CLOUD_FUNCTIONS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Fixed instance pricing so cost assertions don't depend on the pricing cache.
+TEST_PRICING = {
+    'aws': {'region': 'us-east-1', 'instances': [
+        {'type': 't3.medium', 'family': 'General Purpose', 'cpu': 2, 'memory': 4, 'cost_hourly': 0.0416},
+        {'type': 't3.xlarge', 'family': 'General Purpose', 'cpu': 4, 'memory': 16, 'cost_hourly': 0.1664},
+    ]},
+    'gcp': {'region': 'us-east1', 'instances': [
+        {'type': 'e2-standard-2', 'family': 'General Purpose', 'cpu': 2, 'memory': 8, 'cost_hourly': 0.067},
+        {'type': 'e2-standard-4', 'family': 'General Purpose', 'cpu': 4, 'memory': 16, 'cost_hourly': 0.134},
+    ]},
+}
+
+# Tests that read and write Firestore run only against the emulator.
+requires_firestore_emulator = pytest.mark.skipif(
+    not os.getenv('FIRESTORE_EMULATOR_HOST'),
+    reason="FIRESTORE_EMULATOR_HOST is not set"
+)
+
+@pytest.fixture(scope='session')
+def _engine():
+    from app.cloud_assessment import CloudAssessmentEngine
+    return CloudAssessmentEngine()
+
+@pytest.fixture
+def engine(_engine, monkeypatch):
+    """The assessment engine with TEST_PRICING; Firestore is only available under the emulator."""
+    monkeypatch.setattr(_engine, 'pricing_data', {k: dict(v) for k, v in TEST_PRICING.items()})
+    return _engine
+
+@pytest.fixture
+def processing_api(monkeypatch):
+    api = StubProcessingAPI()
+    monkeypatch.setenv('FASTAPI_URL', api.url)
+    yield api
+    api.close()
+
+@pytest.fixture
+def storage_event_data():
+    with open(os.path.join(CLOUD_FUNCTIONS_DIR, 'fixtures', 'storage_event.json')) as f:
+        return json.load(f)
+
+def make_cloud_event(event_data, **data_overrides):
+    attributes = {k: v for k, v in event_data.items() if k != 'data'}
+    return CloudEvent(attributes, {**event_data['data'], **data_overrides})
@@ -0,0 +1,92 @@
+"""Local HTTP stand-ins for the services the cloud functions call."""
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, quote, urlparse
+
+class StubServer:
+    """Serves a handler on a random localhost port from a background thread."""
+    def __init__(self, handler_class):
+        handler_class.stub = self
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class StubProcessingAPI(StubServer):
+    """Records /process-batch requests and answers with a configurable status."""
+    def __init__(self, status=200):
+        self.status = status
+        self.batches = []
+        super().__init__(_ProcessingHandler)
+
+class _ProcessingHandler(_JSONHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.stub.lock:
+            self.stub.batches.append({'path': self.path, 'body': body})
+        self._send_json(self.stub.status, {'accepted': len(body.get('jobs', []))})
+
+class StubAzurePricesAPI(StubServer):
+    """
+    Serves total_items price items in pages of page_size, linked by NextPageLink with
+    $skip like the Azure Retail Prices API. Requests for a skip in drop_once have their
+    connection closed without a response the first time.
+    """
+    def __init__(self, total_items, page_size=100, drop_once=()):
+        self.total_items = total_items
+        self.page_size = page_size
+        self.drop_once = set(drop_once)
+        self.requested_skips = []
+        super().__init__(_AzurePricesHandler)
+
+    def item(self, index):
+        return {
+            'type': 'Consumption',
+            'unitOfMeasure': '1 Hour',
+            'productName': 'Virtual Machines Dsv5 Series',
+            'skuName': f"D{index}s v5",
+            'armSkuName': 'Standard_D2s_v5',
+            'armRegionName': 'eastus',
+            'retailPrice': 0.096,
+            'index': index,
+        }
+
+class _AzurePricesHandler(_JSONHandler):
+    def do_GET(self):
+        stub = self.stub
+        query = parse_qs(urlparse(self.path).query)
+        skip = int(query.get('$skip', ['0'])[0])
+        with stub.lock:
+            stub.requested_skips.append(skip)
+            drop = skip in stub.drop_once
+            stub.drop_once.discard(skip)
+        if drop:
+            self.close_connection = True
+            return
+
+        end = min(skip + stub.page_size, stub.total_items)
+        next_link = None
+        if end < stub.total_items:
+            next_link = f"{stub.url}/api/retail/prices?$filter={quote(query.get('$filter', [''])[0])}&$skip={end}"
+        self._send_json(200, {
+            'Items': [stub.item(i) for i in range(skip, end)],
+            'NextPageLink': next_link,
+            'Count': max(0, end - skip)
+        })
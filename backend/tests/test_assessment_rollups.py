@@ -0,0 +1,123 @@
+import uuid
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+from app import cloud_assessment
+from conftest import requires_firestore_emulator
+
+def _vinfo(rows):
+    return pd.DataFrame(rows, columns=['VM', 'CPUs', 'Memory', 'Powerstate', 'OS'])
+
+VINFO = _vinfo([
+    ['web-01', 2, 4096, 'poweredOn', 'Microsoft Windows Server 2019'],
+    ['db-01', 4, 16384, 'poweredOn', None],
+    ['old-01', 2, 2048, None, ''],
+])
+
+@pytest.fixture
+def analyze_without_saving(engine, monkeypatch):
+    monkeypatch.setattr(engine, '_save_metrics_to_firestore', lambda *args: None)
+    return lambda df: engine.analyze_rvtools_data(df_vinfo=df, customer_id='ACME', doc_code='01')
+
+def test_rollup_totals_and_unknown_categories(engine, analyze_without_saving):
+    analysis = analyze_without_saving(VINFO)
+
+    rollup = engine._build_assessment_rollup(VINFO, analysis, 'rvtools', 'ACME', '01')
+
+    assert rollup['totals'] == {'vms': 3, 'poweredOnVms': 2, 'vcpus': 6, 'memoryGb': 20, 'storageGb': 0, 'disks': 0}
+    assert rollup['distributions']['os'] == {'Microsoft Windows Server 2019': 1, 'Unknown': 2}
+    assert rollup['distributions']['powerState'] == {'poweredOn': 2, 'Unknown': 1}
+    assert rollup['distributions']['cpu'] == {'2': 1, '4': 1}
+    assert (rollup['customerId'], rollup['docCode'], rollup['sourceType']) == ('ACME', '01', 'rvtools')
+
+def test_rollup_cost_omits_providers_without_pricing(engine, analyze_without_saving):
+    engine.pricing_data['azure'] = {'region': 'East US', 'instances': []}
+    analysis = analyze_without_saving(VINFO)
+
+    rollup = engine._build_assessment_rollup(VINFO, analysis, 'rvtools', 'ACME', '01')
+
+    assert set(rollup['costByProvider']) == {'aws', 'gcp'}
+    assert rollup['costByProvider']['gcp'] == analysis['cost_estimates']['gcp']['monthly_cost']
+
+def test_backfill_rollup_from_metrics_is_partial(engine):
+    assessment = {'assessmentId': 'a1', 'sourceType': 'rvtools', 'vms': {
+        'web-01': {'cpu_cores': 2, 'memory_gb': 4.0},
+        'db-01': {'cpu_cores': 4, 'memory_gb': 16.5},
+    }}
+
+    rollup = engine._build_backfill_rollup('ACME', '03', assessment)
+
+    assert rollup['partial'] is True
+    assert rollup['totals'] == {'vms': 2, 'vcpus': 6, 'memoryGb': 20}
+    assert rollup['distributions'] == {'cpu': {'2': 1, '4': 1}}
+    assert rollup['costByProvider'] == {}
+
+# --- Against the Firestore emulator ---
+
+def _customer_id():
+    return uuid.uuid4().hex[:4].upper()
+
+def _metric_count(engine, customer_id, doc_code):
+    return len(list(engine.db.collection('assessmentMetrics')
+                    .where('customerId', '==', customer_id)
+                    .where('docCode', '==', doc_code).stream()))
+
+@requires_firestore_emulator
+def test_assessments_fold_into_customer_rollup(engine):
+    customer_id = _customer_id()
+    first = engine.analyze_rvtools_data(df_vinfo=VINFO, customer_id=customer_id, doc_code='01')
+    second = engine.analyze_rvtools_data(df_vinfo=VINFO.head(1), customer_id=customer_id, doc_code='02')
+
+    rollup = engine.get_customer_rollup(customer_id)
+
+    assert rollup['assessmentCount'] == 2
+    assert rollup['totals']['vms'] == 4
+    assert rollup['totals']['vcpus'] == 8
+    assert rollup['distributions']['os']['Microsoft Windows Server 2019'] == 2
+    assert rollup['costByProvider']['gcp'] == pytest.approx(
+        first['cost_estimates']['gcp']['monthly_cost'] + second['cost_estimates']['gcp']['monthly_cost'])
+    assert [point['docCode'] for point in rollup['history']] == ['01', '02']
+    assert engine.get_assessment_rollup(customer_id, '02')['totals']['vms'] == 1
+
+@requires_firestore_emulator
+def test_repeated_doc_code_conflicts_without_writing_metrics(engine):
+    customer_id = _customer_id()
+    engine.db.collection(cloud_assessment.ROLLUPS_COLLECTION).document(customer_id)\
+        .collection(cloud_assessment.ASSESSMENT_ROLLUPS_SUBCOLLECTION).document('01').set({'docCode': '01'})
+
+    with pytest.raises(HTTPException) as exc_info:
+        engine.analyze_rvtools_data(df_vinfo=VINFO, customer_id=customer_id, doc_code='01')
+
+    assert exc_info.value.status_code == 409
+    assert _metric_count(engine, customer_id, '01') == 0
+
+@requires_firestore_emulator
+def test_history_is_trimmed(engine, monkeypatch):
+    monkeypatch.setattr(cloud_assessment, 'MAX_ROLLUP_HISTORY', 2)
+    customer_id = _customer_id()
+    for doc_code in ('01', '02', '03'):
+        engine.analyze_rvtools_data(df_vinfo=VINFO, customer_id=customer_id, doc_code=doc_code)
+
+    rollup = engine.get_customer_rollup(customer_id)
+
+    assert rollup['assessmentCount'] == 3
+    assert [point['docCode'] for point in rollup['history']] == ['02', '03']
+
+@requires_firestore_emulator
+def test_backfill_rolls_up_legacy_metrics_once(engine):
+    customer_id = _customer_id()
+    metrics = engine.db.collection('assessmentMetrics')
+    for vm, cpus, memory_gb in [('web-01', 2, 4.0), ('db-01', 4, 16.0)]:
+        base = {'assessmentId': 'legacy', 'sourceType': 'rvtools', 'customerId': customer_id,
+                'docCode': '05', 'entityId': vm, 'entityName': vm}
+        metrics.document().set({**base, 'metricType': 'cpu_cores', 'value': cpus})
+        metrics.document().set({**base, 'metricType': 'memory_gb', 'value': memory_gb})
+
+    result = engine.backfill_customer_rollup(customer_id)
+    again = engine.backfill_customer_rollup(customer_id)
+
+    assert result['backfilledDocCodes'] == ['05']
+    assert again == {'customerId': customer_id, 'backfilledDocCodes': [], 'alreadyRolledUp': 1}
+    rollup = engine.get_customer_rollup(customer_id)
+    assert rollup['partialAssessmentCount'] == 1
+    assert rollup['totals'] == {'vms': 2, 'vcpus': 6, 'memoryGb': 20}
@@ -0,0 +1,113 @@
+import pytest
+import requests
+from google.cloud.firestore_v1.bulk_writer import BulkWriteFailure, BulkWriterSetOperation
+from google.cloud.firestore_v1.document import DocumentReference
+import azure_price_importer as importer
+from conftest import requires_firestore_emulator
+from stubs import StubAzurePricesAPI
+
+@pytest.fixture
+def fetch(monkeypatch):
+    """Fetches every page from a stub API without rate limiting or retry delays."""
+    monkeypatch.setattr(importer.time, 'sleep', lambda seconds: None)
+
+    def run(api):
+        return importer._fetch_all_items(requests.Session(), importer._RateLimiter(1000),
+                                         f"{api.url}/api/retail/prices?$filter=x")
+    return run
+
+@pytest.mark.parametrize('sku_name, cpu, memory', [
+    ('Standard_B1ls', 1, 0.5),
+    ('Standard_B1s', 1, 1),
+    ('Standard_B2s', 2, 4),
+    ('Standard_B2ms', 2, 8),
+    ('Standard_A2m_v2', 2, 16),
+    ('Standard_D2_v2', 2, 7),
+    ('Standard_DS3_v2', 4, 14),
+    ('Standard_D4s_v5', 4, 16),
+    ('Standard_E8-4as_v5', 4, 64),
+    ('Standard_M128s', 128, 2048),
+    ('Standard_M128ms', 128, 3892),
+    ('Standard_NC6s_v3', 6, 112),
+])
+def test_parse_azure_sku_uses_explicit_specs(sku_name, cpu, memory):
+    assert importer._parse_azure_sku(sku_name) == {'cpu': cpu, 'memory': memory}
+
+@pytest.mark.parametrize('sku_name', ['Standard_D2_v2_Promo', 'Standard_X4s_v9', 'Standard_D3s_v5', 'Basic_A1'])
+def test_parse_azure_sku_skips_unknown_series_and_sizes(sku_name):
+    assert importer._parse_azure_sku(sku_name) == {'cpu': 'N/A', 'memory': 'N/A'}
+
+def test_skip_windows_stop_at_last_page(fetch, monkeypatch):
+    monkeypatch.setattr(importer, 'FETCH_CONCURRENCY', 4)
+    api = StubAzurePricesAPI(total_items=1050, page_size=100)
+    try:
+        items = fetch(api)
+    finally:
+        api.close()
+
+    assert sorted(item['index'] for item in items) == list(range(1050))
+    # First page, then windows of 4 pages from $skip=100; the window holding the last
+    # page (skip 1000) is the last one requested.
+    assert sorted(api.requested_skips) == list(range(0, 1300, 100))
+
+def test_window_ending_on_last_page_stops_there(fetch, monkeypatch):
+    monkeypatch.setattr(importer, 'FETCH_CONCURRENCY', 4)
+    api = StubAzurePricesAPI(total_items=500, page_size=100)
+    try:
+        items = fetch(api)
+    finally:
+        api.close()
+
+    assert len(items) == 500
+    assert sorted(api.requested_skips) == [0, 100, 200, 300, 400]
+
+def test_dropped_connections_are_retried(fetch):
+    api = StubAzurePricesAPI(total_items=450, page_size=100, drop_once={0, 200})
+    try:
+        items = fetch(api)
+    finally:
+        api.close()
+
+    assert sorted(item['index'] for item in items) == list(range(450))
+    assert api.requested_skips.count(200) == 2
+
+def test_persistent_failures_abort_the_import(fetch, monkeypatch):
+    monkeypatch.setattr(importer, 'MAX_RETRIES', 2)
+    api = StubAzurePricesAPI(total_items=100, page_size=100)
+    api.close() # Nothing listening: every attempt is refused
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        fetch(api)
+
+def _write_failure(doc_id, attempts):
+    operation = BulkWriterSetOperation(DocumentReference(importer.PRICING_COLLECTION, doc_id), {}, merge=True, attempts=attempts)
+    return BulkWriteFailure(operation=operation, code=4, message='Deadline exceeded')
+
+def test_write_tally_retries_until_attempts_run_out():
+    tally = importer._WriteTally()
+
+    assert tally.on_error(_write_failure('azure-eastus-Standard_D2s_v5', 1), None) is True
+    assert tally.failures == []
+    assert tally.on_error(_write_failure('azure-eastus-Standard_D2s_v5', importer.MAX_WRITE_ATTEMPTS), None) is False
+    assert tally.failures == ['azure-eastus-Standard_D2s_v5: Deadline exceeded']
+
+def test_write_tally_counts_committed_writes():
+    tally = importer._WriteTally()
+    for _ in range(3):
+        tally.on_result(None, None, None)
+
+    assert tally.committed == 3
+
+@requires_firestore_emulator
+def test_update_azure_prices_writes_parsed_skus(monkeypatch):
+    api = StubAzurePricesAPI(total_items=250, page_size=100)
+    monkeypatch.setattr(importer, 'AZURE_PRICES_API_URL', f"{api.url}/api/retail/prices")
+    try:
+        message, status = importer.update_azure_prices(None)
+    finally:
+        api.close()
+
+    assert status == 200, message
+    assert 'updated/verified 1 Azure' in message # 250 items, all the same SKU
+    doc = importer._get_db().collection(importer.PRICING_COLLECTION).document('azure-eastus-Standard_D2s_v5').get()
+    assert doc.get('cpu') == 2 and doc.get('memory') == 8.0 and doc.get('costHourly') == 0.096
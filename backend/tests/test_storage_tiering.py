@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+def _vdisk(capacities_mb, vms=None):
+    df = pd.DataFrame({'Capacity MB': capacities_mb})
+    if vms is not None:
+        df['VM'] = vms
+    return df
+
+def test_disk_at_tier_max_size_uses_that_tier(engine):
+    storage = engine._analyze_storage_requirements(_vdisk([32 * 1024], vms=['web-01']))
+
+    azure = storage['storage_tiering']['azure']
+    assert azure['tier_distribution'] == {'P4': 1}
+    assert azure['monthly_cost'] == 5.28
+
+def test_oversized_disk_is_striped_across_largest_tier(engine):
+    storage = engine._analyze_storage_requirements(_vdisk([40 * 1024 * 1024], vms=['db-01']))
+
+    azure = storage['storage_tiering']['azure']
+    assert azure['tier_distribution'] == {'P80': 1}
+    assert azure['oversized_disks'] == 1
+    assert azure['monthly_cost'] == pytest.approx(2 * 3604.12) # ceil(40960 / 32767) P80 disks
+
+def test_disks_without_usable_capacity_are_dropped(engine):
+    storage = engine._analyze_storage_requirements(
+        _vdisk([0, np.nan, 'n/a', 10 * 1024], vms=['a', 'b', 'c', 'd']))
+
+    assert storage['total_disks'] == 1
+    assert storage['vms_with_disks'] == 1
+    assert storage['storage_tiering']['azure']['tier_distribution'] == {'P3': 1}
+
+def test_only_unusable_disks_give_no_storage_analysis(engine):
+    assert engine._analyze_storage_requirements(_vdisk([0, np.nan, 'n/a'])) == {}
+
+def test_missing_vm_column_omits_per_vm_stats(engine):
+    storage = engine._analyze_storage_requirements(_vdisk([10 * 1024, 100 * 1024]))
+
+    assert storage['total_disks'] == 2
+    assert storage['largest_disk_gb'] == 100
+    assert 'vms_with_disks' not in storage and 'largest_vms_by_storage' not in storage
+    assert storage['storage_tiering']['azure']['tier_distribution'] == {'P3': 1, 'P10': 1}
+
+def test_cost_estimate_adds_storage_to_compute(engine):
+    vms = pd.DataFrame([['web-01', 2, 4096, 'poweredOn']], columns=['VM', 'CPUs', 'Memory', 'Powerstate'])
+    storage = engine._analyze_storage_requirements(_vdisk([100 * 1024], vms=['web-01']))
+
+    costs = engine._estimate_cloud_costs(vms, storage)
+
+    aws = costs['aws']
+    assert aws['storage_monthly_cost'] == storage['storage_tiering']['aws']['monthly_cost'] == 8.0
+    assert aws['compute_monthly_cost'] == round(0.0416 * 730, 2)
+    assert aws['monthly_cost'] == round(aws['compute_monthly_cost'] + aws['storage_monthly_cost'], 2)
+    assert aws['storage_tier_distribution'] == {'gp3': 1}
+    assert engine._estimate_cloud_costs(vms)['aws']['storage_monthly_cost'] == 0.0
@@ -0,0 +1,200 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+import requests
+import main
+from conftest import make_cloud_event, requires_firestore_emulator
+
+@pytest.fixture(autouse=True)
+def fresh_instance(monkeypatch):
+    """Each test starts as a cold instance with no coalescing delay."""
+    monkeypatch.setattr(main, '_seen_events', {})
+    monkeypatch.setattr(main, '_session', None)
+    monkeypatch.setattr(main, 'COALESCE_WINDOW_SECONDS', 0)
+
+def test_dispatch_batch_posts_coalesced_jobs(processing_api):
+    uploads = [{'job_id': 'job1', 'file_path': 'uploads/job1/a.xlsx'},
+               {'job_id': 'job2', 'file_path': 'uploads/job2/b.xlsx'}]
+
+    main._dispatch_batch('ACME', uploads)
+
+    assert processing_api.batches == [{
+        'path': '/process-batch',
+        'body': {'customer_id': 'ACME', 'jobs': uploads}
+    }]
+
+def test_dispatch_batch_raises_on_api_error(processing_api):
+    processing_api.status = 503
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        main._dispatch_batch('ACME', [{'job_id': 'job1', 'file_path': 'uploads/job1/a.xlsx'}])
+
+def test_objects_outside_uploads_are_ignored(storage_event_data, processing_api):
+    main.trigger_processing(make_cloud_event(storage_event_data, name='reports/summary.pdf'))
+
+    assert processing_api.batches == []
+
+# --- Against the Firestore emulator ---
+
+def _create_job(db, customer_id, job_id=None, **fields):
+    job_id = job_id or f"job_{uuid.uuid4().hex[:8]}"
+    db.collection(main.JOBS_COLLECTION).document(job_id).set({'customerId': customer_id, **fields})
+    return job_id
+
+@requires_firestore_emulator
+def test_fixture_event_is_dispatched_once(storage_event_data, processing_api):
+    db = main._get_db()
+    customer_id = f"C{uuid.uuid4().hex[:6]}"
+    job_id = _create_job(db, customer_id)
+    event = make_cloud_event(storage_event_data, name=f"uploads/{job_id}/rvtools_export.xlsx",
+                             generation=uuid.uuid4().hex)
+
+    main.trigger_processing(event)
+    main._seen_events.clear() # Redelivery to another instance
+    main.trigger_processing(event)
+
+    assert processing_api.batches == [{
+        'path': '/process-batch',
+        'body': {'customer_id': customer_id, 'jobs': [{'job_id': job_id, 'file_path': f"uploads/{job_id}/rvtools_export.xlsx"}]}
+    }]
+
+@requires_firestore_emulator
+def test_flat_upload_falls_back_to_file_path(storage_event_data, processing_api):
+    db = main._get_db()
+    file_name = f"uploads/{uuid.uuid4().hex}.xlsx"
+    job_id = _create_job(db, f"C{uuid.uuid4().hex[:6]}", filePath=file_name)
+
+    main.trigger_processing(make_cloud_event(storage_event_data, name=file_name, generation=uuid.uuid4().hex))
+
+    assert processing_api.batches[0]['body']['jobs'] == [{'job_id': job_id, 'file_path': file_name}]
+
+@requires_firestore_emulator
+def test_missing_job_is_retried_without_claiming_event(storage_event_data, processing_api):
+    db = main._get_db()
+    job_id = f"job_{uuid.uuid4().hex[:8]}"
+    recent = dict(storage_event_data, time=datetime.now(timezone.utc).isoformat())
+    event = make_cloud_event(recent, name=f"uploads/{job_id}/late.xlsx", generation=uuid.uuid4().hex)
+
+    with pytest.raises(LookupError):
+        main.trigger_processing(event)
+
+    _create_job(db, f"C{uuid.uuid4().hex[:6]}", job_id=job_id)
+    main.trigger_processing(event)
+
+    assert len(processing_api.batches) == 1
+
+@requires_firestore_emulator
+def test_expired_open_batch_is_taken_over(storage_event_data, processing_api):
+    db = main._get_db()
+    customer_id = f"C{uuid.uuid4().hex[:6]}"
+    stranded = {'job_id': 'stranded', 'file_path': 'uploads/stranded/old.xlsx'}
+    db.collection(main.PROCESSING_BATCHES_COLLECTION).document(customer_id).set({
+        'batchId': 'dead-instance',
+        'status': 'open',
+        'expiresAt': datetime.now(timezone.utc) - timedelta(minutes=5),
+        'uploads': [stranded]
+    })
+    job_id = _create_job(db, customer_id)
+
+    main.trigger_processing(make_cloud_event(storage_event_data, name=f"uploads/{job_id}/new.xlsx",
+                                             generation=uuid.uuid4().hex))
+
+    assert processing_api.batches[0]['body']['jobs'] == [stranded, {'job_id': job_id, 'file_path': f"uploads/{job_id}/new.xlsx"}]
+
+@requires_firestore_emulator
+def test_sweeper_dispatches_expired_batches(processing_api):
+    db = main._get_db()
+    customer_id = f"C{uuid.uuid4().hex[:6]}"
+    stranded = {'job_id': 'stranded', 'file_path': 'uploads/stranded/old.xlsx'}
+    db.collection(main.PROCESSING_BATCHES_COLLECTION).document(customer_id).set({
+        'batchId': 'dead-instance',
+        'status': 'open',
+        'expiresAt': datetime.now(timezone.utc) - timedelta(minutes=5),
+        'uploads': [stranded]
+    })
+
+    main.sweep_processing_batches(None)
+
+    assert {'path': '/process-batch', 'body': {'customer_id': customer_id, 'jobs': [stranded]}} in processing_api.batches
+    batch_ref = db.collection(main.PROCESSING_BATCHES_COLLECTION).document(customer_id)
+    assert batch_ref.get().get('status') == 'closed'
+    assert batch_ref.collection(main.DISPATCHES_SUBCOLLECTION).document('dead-instance').get().get('status') == 'dispatched'
+
+@requires_firestore_emulator
+def test_uploads_within_window_are_sent_as_one_request(processing_api):
+    db = main._get_db()
+    customer_id = f"C{uuid.uuid4().hex[:6]}"
+    batch_ref = db.collection(main.PROCESSING_BATCHES_COLLECTION).document(customer_id)
+    uploads = [{'job_id': f"job{i}", 'file_path': f"uploads/job{i}/rvtools_{i}.xlsx"} for i in range(2)]
+
+    outcomes = []
+    for upload in uploads:
+        event_key = f"bucket/{upload['file_path']}#1"
+        event_ref = db.collection(main.TRIGGER_EVENTS_COLLECTION).document(uuid.uuid4().hex)
+        outcomes.append(main._enqueue_upload(db.transaction(), batch_ref, event_ref, event_key, upload, customer_id))
+    main._close_and_dispatch(db, batch_ref, outcomes[0])
+
+    assert outcomes[1] == 'coalesced'
+    assert processing_api.batches == [{
+        'path': '/process-batch',
+        'body': {'customer_id': customer_id, 'jobs': uploads}
+    }]
+
+@requires_firestore_emulator
+def test_job_without_customer_is_sent_alone(storage_event_data, processing_api):
+    db = main._get_db()
+    job_id = f"job_{uuid.uuid4().hex[:8]}"
+    db.collection(main.JOBS_COLLECTION).document(job_id).set({'status': 'uploaded'})
+
+    main.trigger_processing(make_cloud_event(storage_event_data, name=f"uploads/{job_id}/a.xlsx",
+                                             generation=uuid.uuid4().hex))
+
+    assert processing_api.batches[0]['body'] == {'customer_id': None, 'jobs': [{'job_id': job_id, 'file_path': f"uploads/{job_id}/a.xlsx"}]}
+
+@requires_firestore_emulator
+def test_claimed_events_expire(storage_event_data, processing_api):
+    db = main._get_db()
+    job_id = _create_job(db, f"C{uuid.uuid4().hex[:6]}")
+    generation = uuid.uuid4().hex
+    file_name = f"uploads/{job_id}/a.xlsx"
+
+    main.trigger_processing(make_cloud_event(storage_event_data, name=file_name, generation=generation))
+
+    event_key = f"{storage_event_data['data']['bucket']}/{file_name}#{generation}"
+    event = db.collection(main.TRIGGER_EVENTS_COLLECTION).document(main.hashlib.sha256(event_key.encode()).hexdigest()).get()
+    assert event.get('expireAt') > datetime.now(timezone.utc) + timedelta(days=7)
+
+@requires_firestore_emulator
+def test_failed_dispatch_marks_jobs_and_finishes_lease(storage_event_data, processing_api):
+    db = main._get_db()
+    processing_api.status = 500
+    customer_id = f"C{uuid.uuid4().hex[:6]}"
+    job_id = _create_job(db, customer_id)
+
+    main.trigger_processing(make_cloud_event(storage_event_data, name=f"uploads/{job_id}/a.xlsx",
+                                             generation=uuid.uuid4().hex))
+
+    assert db.collection(main.JOBS_COLLECTION).document(job_id).get().get('status') == 'error'
+    dispatches = db.collection(main.PROCESSING_BATCHES_COLLECTION).document(customer_id)\
+        .collection(main.DISPATCHES_SUBCOLLECTION).stream()
+    assert [d.get('status') for d in dispatches] == ['failed']
+
+@requires_firestore_emulator
+def test_sweeper_resends_dispatch_with_expired_lease(processing_api):
+    db = main._get_db()
+    customer_id = f"C{uuid.uuid4().hex[:6]}"
+    stuck = {'job_id': 'stuck', 'file_path': 'uploads/stuck/a.xlsx'}
+    dispatch_ref = db.collection(main.PROCESSING_BATCHES_COLLECTION).document(customer_id)\
+        .collection(main.DISPATCHES_SUBCOLLECTION).document('died-mid-send')
+    dispatch_ref.set({
+        'batchId': 'died-mid-send',
+        'customerId': customer_id,
+        'status': 'dispatching',
+        'leaseExpiresAt': datetime.now(timezone.utc) - timedelta(minutes=1),
+        'uploads': [stuck]
+    })
+
+    main.sweep_processing_batches(None)
+
+    assert {'path': '/process-batch', 'body': {'customer_id': customer_id, 'jobs': [stuck]}} in processing_api.batches
+    assert dispatch_ref.get().get('status') == 'dispatched'